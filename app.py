@@ -1,8 +1,21 @@
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, FastAPI, HTTPException
 from pydantic import BaseModel
 from transformers import T5Tokenizer, T5ForConditionalGeneration
+from transformers.modeling_outputs import BaseModelOutput
 from fastapi.middleware.cors import CORSMiddleware
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import logging
+import os
 import re
+import resource
+import signal
+import sys
+import threading
+import torch
+
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI(title='Text Summarization System', description="Summarize dialogues with T5", version="1.0")
 
@@ -18,8 +31,79 @@ model = T5ForConditionalGeneration.from_pretrained("phuckhang1908/T5_summary")
 tokenizer = T5Tokenizer.from_pretrained("phuckhang1908/T5_summary")
 model = model.to("cpu")
 
+# Optional smaller T5 checkpoint used as the draft model for speculative decoding. It must share the
+# main model's vocabulary and special tokens, otherwise its proposals are meaningless to the main model.
+DRAFT_MODEL_PATH = os.getenv("DRAFT_MODEL_PATH")
+draft_model = None
+if DRAFT_MODEL_PATH:
+    draft_model = T5ForConditionalGeneration.from_pretrained(DRAFT_MODEL_PATH, local_files_only=True)
+    draft_model = draft_model.to("cpu")
+    for attr in ("vocab_size", "decoder_start_token_id", "eos_token_id", "pad_token_id"):
+        draft_value, model_value = getattr(draft_model.config, attr), getattr(model.config, attr)
+        if draft_value != model_value:
+            raise RuntimeError(f"Draft model at {DRAFT_MODEL_PATH} has {attr}={draft_value}, but the main model has {attr}={model_value}")
+
+MAX_INPUT_LENGTH = 512
+ENCODER_CACHE_MAX_MB = float(os.getenv("ENCODER_CACHE_MAX_MB", "256"))
+# Once the worker's resident memory passes this many MB it drains and exits so it can be restarted. 0 disables the check.
+MAX_WORKER_RSS_MB = float(os.getenv("MAX_WORKER_RSS_MB", "0"))
+
+# Model inputs are written into these buffers and passed on as views, so requests do not allocate
+# fresh input tensors. input_ids_buffer shares memory with input_ids_array, so token ids are written
+# straight into it. inference_lock keeps requests from sharing them concurrently.
+input_ids_array = array('q', [0] * MAX_INPUT_LENGTH)
+with torch.inference_mode():
+    input_ids_buffer = torch.frombuffer(input_ids_array, dtype=torch.long).view(1, MAX_INPUT_LENGTH)
+    attention_mask_buffer = torch.ones((1, MAX_INPUT_LENGTH), dtype=torch.long)
+inference_lock = threading.Lock()
+recycling = False
+
 class DialogueInput(BaseModel):
     dialogue: str
+    conversation_id: Optional[str] = None
+    speculative: bool = False
+
+class ConversationState:
+    def __init__(self, lines: List[str], line_ids: List[List[int]], input_ids: List[int], hidden_states: torch.Tensor):
+        self.lines = lines
+        self.line_ids = line_ids
+        self.input_ids = input_ids
+        self.hidden_states = hidden_states
+
+    @property
+    def nbytes(self) -> int:
+        token_count = sum(len(ids) for ids in self.line_ids) + len(self.input_ids)
+        return self.hidden_states.element_size() * self.hidden_states.nelement() + 8 * token_count
+
+class EncoderCache:
+    # LRU of conversation_id -> ConversationState, bounded by the approximate size of the cached states.
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[ConversationState]:
+        with self.lock:
+            state = self.entries.get(key)
+            if state is not None:
+                self.entries.move_to_end(key)
+            return state
+
+    def put(self, key: str, state: ConversationState):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            if state.nbytes > self.max_bytes:
+                return
+            self.entries[key] = state
+            self.size += state.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+encoder_cache = EncoderCache(int(ENCODER_CACHE_MAX_MB * 1024 * 1024))
 
 def clean_text(text: str) -> str:
     text = re.sub(r'\r\n|\n', '\n', text)
@@ -28,20 +112,107 @@ def clean_text(text: str) -> str:
     text = '\n'.join([line.strip() for line in text.split('\n') if line.strip()])
     return text.lower()
 
-def summarize_dialogue(dialogue: str) -> str:
+def fill_input_ids(ids: List[int]) -> torch.Tensor:
+    for i, token in enumerate(ids):
+        input_ids_array[i] = token
+    return input_ids_buffer[:, :len(ids)]
+
+def tokenize_dialogue(dialogue: str, state: Optional[ConversationState] = None) -> Tuple[List[str], List[List[int]], List[int]]:
+    # SentencePiece treats newlines as word boundaries, so tokenizing line by line and concatenating
+    # should yield the same ids as tokenizing the whole dialogue (benchmarks/check_tokenization.py
+    # verifies this). That lets a re-submitted conversation reuse the ids of every unchanged leading
+    # line and only tokenize the tail.
+    lines = dialogue.split('\n')
+    reused = 0
+    if state is not None:
+        for old_line, new_line in zip(state.lines, lines):
+            if old_line != new_line:
+                break
+            reused += 1
+
+    line_ids = list(state.line_ids[:reused]) if state is not None else []
+    token_count = sum(len(ids) for ids in line_ids)
+    for line in lines[reused:]:
+        # Everything past the truncation point is dropped anyway, so stop tokenizing there.
+        if token_count >= MAX_INPUT_LENGTH - 1:
+            break
+        ids = tokenizer.encode(line, add_special_tokens=False)
+        line_ids.append(ids)
+        token_count += len(ids)
+
+    input_ids = [token for ids in line_ids for token in ids][:MAX_INPUT_LENGTH - 1]
+    input_ids.append(tokenizer.eos_token_id)
+    return lines[:len(line_ids)], line_ids, input_ids
+
+@torch.inference_mode()
+def summarize_dialogue(dialogue: str, conversation_id: Optional[str] = None, speculative: bool = False) -> str:
+    if speculative and draft_model is None:
+        raise ValueError("speculative decoding requires DRAFT_MODEL_PATH to be set")
+
     dialogue = clean_text(dialogue)
-    inputs = tokenizer(dialogue, return_tensors="pt",truncation=True ,padding="max_length", max_length=512)
-
-    outputs = model.generate(
-        inputs["input_ids"],
-        max_length=150,
-        num_beams=4,
-        early_stopping=True
-    )
+    if speculative:
+        # Assisted generation only supports greedy/sampling, so the draft model proposes tokens
+        # and the main model verifies them in a single forward pass instead of running 4 beams.
+        decoding_kwargs = {"assistant_model": draft_model, "num_beams": 1}
+    else:
+        decoding_kwargs = {"num_beams": 4, "early_stopping": True}
+
+    with inference_lock:
+        if conversation_id is None:
+            state = None
+            ids = tokenizer(dialogue, truncation=True, max_length=MAX_INPUT_LENGTH)["input_ids"]
+        else:
+            state = encoder_cache.get(conversation_id)
+            lines, line_ids, ids = tokenize_dialogue(dialogue, state)
+
+        input_ids = fill_input_ids(ids)
+        # The T5 encoder is bidirectional, so hidden states can only be reused when the truncated
+        # input is unchanged: a retried request, or a conversation that already fills the window.
+        if state is not None and state.input_ids == ids:
+            hidden_states = state.hidden_states
+        else:
+            hidden_states = model.get_encoder()(input_ids=input_ids).last_hidden_state
+        if conversation_id is not None:
+            encoder_cache.put(conversation_id, ConversationState(lines, line_ids, ids, hidden_states))
+
+        outputs = model.generate(
+            input_ids,
+            attention_mask=attention_mask_buffer[:, :len(ids)],
+            encoder_outputs=BaseModelOutput(last_hidden_state=hidden_states),
+            max_length=150,
+            **decoding_kwargs
+        )
     summary = tokenizer.decode(outputs[0], skip_special_tokens=True)
     return summary
 
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # No procfs (e.g. macOS): fall back to the peak RSS, reported in bytes there and KB on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def check_worker_memory():
+    global recycling
+    if MAX_WORKER_RSS_MB <= 0 or recycling:
+        return
+    rss = current_rss_mb()
+    if rss > MAX_WORKER_RSS_MB:
+        recycling = True
+        logger.warning("Worker %d RSS %.0f MB exceeds %.0f MB, recycling", os.getpid(), rss, MAX_WORKER_RSS_MB)
+        # uvicorn shuts down gracefully on SIGTERM: in-flight requests finish before the process
+        # exits. The image runs a single uvicorn process as the container's main process, so its exit
+        # triggers the container restart policy.
+        os.kill(os.getpid(), signal.SIGTERM)
+
 @app.post('/summarize/')
-async def summarize(dialogue_input: DialogueInput):
-    summary = summarize_dialogue(dialogue_input.dialogue)
+async def summarize(dialogue_input: DialogueInput, background_tasks: BackgroundTasks):
+    if recycling:
+        raise HTTPException(status_code=503, detail="worker is restarting", headers={"Retry-After": "1"})
+    if dialogue_input.speculative and draft_model is None:
+        raise HTTPException(status_code=400, detail="speculative decoding is not enabled on this server")
+    summary = summarize_dialogue(dialogue_input.dialogue, dialogue_input.conversation_id, dialogue_input.speculative)
+    background_tasks.add_task(check_worker_memory)
     return {'summary': summary}
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser(description="Compare speculative decoding against beam search on a fixed corpus")
+parser.add_argument("--draft", default=os.getenv("DRAFT_MODEL_PATH"), help="local path of the draft T5 checkpoint")
+parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "dialogues.json"))
+parser.add_argument("--repeats", type=int, default=3)
+parser.add_argument("--min-agreement", type=float, default=0.8, help="minimum mean ROUGE-L F1 against beam search")
+args = parser.parse_args()
+
+if not args.draft:
+    parser.error("--draft or DRAFT_MODEL_PATH is required")
+os.environ["DRAFT_MODEL_PATH"] = args.draft
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import summarize_dialogue
+
+def rouge_l(reference: str, candidate: str) -> float:
+    ref, cand = reference.split(), candidate.split()
+    if not ref or not cand:
+        return float(ref == cand)
+    lengths = [0] * (len(cand) + 1)
+    for r in ref:
+        prev = 0
+        for j, c in enumerate(cand, 1):
+            prev, lengths[j] = lengths[j], prev + 1 if r == c else max(lengths[j], lengths[j - 1])
+    lcs = lengths[-1]
+    if lcs == 0:
+        return 0.0
+    precision, recall = lcs / len(cand), lcs / len(ref)
+    return 2 * precision * recall / (precision + recall)
+
+def timed(dialogue: str, speculative: bool):
+    best, summary = float("inf"), None
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        summary = summarize_dialogue(dialogue, speculative=speculative)
+        best = min(best, time.perf_counter() - start)
+    return best, summary
+
+with open(args.corpus) as f:
+    corpus = json.load(f)
+
+# Warm up both decoding paths so one-off initialisation is not attributed to either.
+summarize_dialogue(corpus[0])
+summarize_dialogue(corpus[0], speculative=True)
+
+beam_times, spec_times, scores, exact = [], [], [], 0
+for i, dialogue in enumerate(corpus):
+    beam_time, beam_summary = timed(dialogue, False)
+    spec_time, spec_summary = timed(dialogue, True)
+    score = rouge_l(beam_summary, spec_summary)
+    beam_times.append(beam_time)
+    spec_times.append(spec_time)
+    scores.append(score)
+    exact += beam_summary == spec_summary
+    print(f"[{i}] beam {beam_time * 1000:.0f} ms, speculative {spec_time * 1000:.0f} ms, rouge-l {score:.3f}")
+
+speedup = sum(beam_times) / sum(spec_times)
+agreement = statistics.mean(scores)
+print(f"total beam {sum(beam_times):.2f} s, speculative {sum(spec_times):.2f} s, speedup {speedup:.2f}x")
+print(f"mean rouge-l {agreement:.3f}, exact matches {exact}/{len(corpus)}")
+
+if agreement < args.min_agreement:
+    print(f"agreement {agreement:.3f} is below the {args.min_agreement} bound")
+    sys.exit(1)
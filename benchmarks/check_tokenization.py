@@ -0,0 +1,41 @@
+import argparse
+import json
+import os
+import sys
+
+parser = argparse.ArgumentParser(description="Check that incremental line-by-line tokenization matches tokenizing the whole dialogue")
+parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "dialogues.json"))
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import torch
+from app import MAX_INPUT_LENGTH, ConversationState, clean_text, tokenize_dialogue, tokenizer
+
+with open(args.corpus) as f:
+    corpus = json.load(f)
+# One dialogue well past the 512-token window, to cover truncation and the early stop in tokenize_dialogue.
+corpus.append("\n".join(corpus * 5))
+
+failures = 0
+for i, dialogue in enumerate(corpus):
+    dialogue = clean_text(dialogue)
+    expected = tokenizer(dialogue, truncation=True, max_length=MAX_INPUT_LENGTH)["input_ids"]
+
+    # A conversation submitted whole, then the same conversation grown one turn at a time.
+    _, _, fresh = tokenize_dialogue(dialogue)
+    state = None
+    turns = dialogue.split("\n")
+    for n in range(1, len(turns) + 1):
+        lines, line_ids, grown = tokenize_dialogue("\n".join(turns[:n]), state)
+        state = ConversationState(lines, line_ids, grown, torch.empty(0))
+
+    for label, ids in (("whole", fresh), ("incremental", grown)):
+        if ids != expected:
+            failures += 1
+            print(f"[{i}] {label} tokenization differs from the tokenizer ({len(ids)} vs {len(expected)} ids)")
+    print(f"[{i}] {len(expected)} ids checked")
+
+if failures:
+    sys.exit(1)
+print(f"all {len(corpus)} dialogues match")
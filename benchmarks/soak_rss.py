@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser(description="Check that worker RSS stays flat over a long run of /summarize/ requests")
+parser.add_argument("--requests", type=int, default=100000)
+parser.add_argument("--warmup", type=int, default=200, help="requests to run before taking the baseline RSS")
+parser.add_argument("--sample-every", type=int, default=1000)
+parser.add_argument("--conversations", type=int, default=50, help="distinct conversation ids to cycle through")
+parser.add_argument("--max-turns", type=int, default=120, help="turns a conversation grows to before it starts over")
+parser.add_argument("--max-growth-mb", type=float, default=50.0, help="allowed RSS growth over the baseline")
+parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "dialogues.json"))
+args = parser.parse_args()
+
+# Requests go through the FastAPI app, including the background RSS check after every response. The
+# threshold is set high enough that the check runs but never recycles the process under the soak.
+os.environ["MAX_WORKER_RSS_MB"] = str(10 ** 9)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.testclient import TestClient
+from app import app, current_rss_mb, encoder_cache
+
+def rss_without_cache_mb() -> float:
+    # The encoder cache legitimately fills up to ENCODER_CACHE_MAX_MB during the run, so it is
+    # subtracted to leave only memory the request path should not be holding on to.
+    return current_rss_mb() - encoder_cache.size / (1024 * 1024)
+
+with open(args.corpus) as f:
+    corpus = json.load(f)
+turns = [dialogue.split("\n") for dialogue in corpus]
+visits = [0] * args.conversations
+client = TestClient(app)
+
+def run(i: int):
+    # Odd requests are one-shot summaries. Even requests grow one conversation by a turn each time it
+    # comes round, cycling through its dialogue's turns until it is well past the 512-token window, so
+    # both prefix reuse and the exact-match encoder reuse are exercised.
+    if i % 2:
+        payload = {"dialogue": corpus[i % len(corpus)]}
+    else:
+        conversation = (i // 2) % args.conversations
+        n = visits[conversation] % args.max_turns + 1
+        visits[conversation] += 1
+        conversation_turns = turns[conversation % len(turns)]
+        dialogue = "\n".join(conversation_turns[t % len(conversation_turns)] for t in range(n))
+        payload = {"dialogue": dialogue, "conversation_id": str(conversation)}
+    response = client.post("/summarize/", json=payload)
+    if response.status_code != 200:
+        print(f"request {i} failed with {response.status_code}: {response.text}")
+        sys.exit(1)
+
+for i in range(args.warmup):
+    run(i)
+
+baseline = rss_without_cache_mb()
+peak = baseline
+start = time.perf_counter()
+print(f"baseline RSS (excluding encoder cache) {baseline:.1f} MB after {args.warmup} warmup requests")
+for i in range(1, args.requests + 1):
+    run(args.warmup + i)
+    if i % args.sample_every == 0 or i == args.requests:
+        rss = rss_without_cache_mb()
+        peak = max(peak, rss)
+        rate = i / (time.perf_counter() - start)
+        cache_mb = encoder_cache.size / (1024 * 1024)
+        print(f"{i:>7} requests  RSS {rss:.1f} MB  ({rss - baseline:+.1f} MB) + cache {cache_mb:.1f} MB  {rate:.1f} req/s")
+
+final = rss_without_cache_mb()
+print(f"final RSS {final:.1f} MB, peak {peak:.1f} MB, growth {final - baseline:+.1f} MB")
+if peak - baseline > args.max_growth_mb:
+    print(f"RSS grew by {peak - baseline:.1f} MB, more than the {args.max_growth_mb} MB bound")
+    sys.exit(1)